@@ -0,0 +1,231 @@
+import json
+import threading
+import zlib
+from datetime import date
+import auth_manager
+
+# Constants
+GRAPH_FILE = auth_manager.CONFIG_DIR / 'artist_graph.json'
+WINDOW = 5               # Artists within this many positions of each other in a container are linked
+MAX_NEIGHBORS = 50       # Strongest edges kept per artist
+MAX_TRACKS = 20          # Most recently seen tracks kept per artist
+HOP_DECAY = 0.5          # Score multiplier for second-hop neighbors
+MAX_ARTISTS = 5000       # Least recently seen artists are dropped beyond this
+MAX_AGE_DAYS = 180       # Artists (and container fingerprints) not seen for this long are dropped
+
+class IndexedTrack:
+    """
+    Lightweight stand-in for a tidalapi track, rebuilt from the index.
+    Carries what the rest of the pipeline reads: id, name, artist, album, bpm.
+    """
+
+    class _Ref:
+        def __init__(self, id, name):
+            self.id = id
+            self.name = name
+
+    def __init__(self, id, name, artist_id, artist_name, album_id=None, album_name=None, bpm=None):
+        self.id = id
+        self.name = name
+        self.artist = self._Ref(artist_id, artist_name)
+        self.artists = [self.artist]
+        self.album = self._Ref(album_id, album_name) if album_id is not None else None
+        self.bpm = bpm
+
+_lock = threading.Lock()
+_graph = None
+_sources = None  # Container key -> [fingerprint of its track ids, last seen date]
+_dirty = False
+
+def _load():
+    global _graph, _sources
+    if _graph is not None:
+        return _graph
+    _graph = {}
+    _sources = {}
+    if GRAPH_FILE.exists():
+        try:
+            with open(GRAPH_FILE, 'r') as f:
+                data = json.load(f)
+            _graph = data.get("artists", {})
+            _sources = data.get("sources", {})
+        except Exception as e:
+            print(f"Warning: Could not read artist graph, starting fresh: {e}")
+            _graph = {}
+            _sources = {}
+    today = date.today().isoformat()
+    for node in _graph.values():
+        node.setdefault("seen", today)
+    return _graph
+
+def _days_since(day):
+    try:
+        return (date.today() - date.fromisoformat(day)).days
+    except (TypeError, ValueError):
+        return 0
+
+def _prune(graph):
+    """Drop artists not seen for MAX_AGE_DAYS, then the least recently seen beyond MAX_ARTISTS."""
+    drop = {key for key, node in graph.items() if _days_since(node.get("seen")) > MAX_AGE_DAYS}
+    if len(graph) - len(drop) > MAX_ARTISTS:
+        kept = sorted((key for key in graph if key not in drop), key=lambda k: graph[k].get("seen", ""))
+        drop.update(kept[:len(kept) - MAX_ARTISTS])
+    for key in drop:
+        del graph[key]
+    if drop:
+        for node in graph.values():
+            for key in [k for k in node["adj"] if k in drop]:
+                del node["adj"][key]
+    for source in [k for k, (_, seen) in _sources.items() if _days_since(seen) > MAX_AGE_DAYS]:
+        del _sources[source]
+
+def _artist_of(track):
+    artist = getattr(track, 'artist', None)
+    if artist is None:
+        artists = getattr(track, 'artists', None) or []
+        artist = artists[0] if artists else None
+    if artist is None or getattr(artist, 'id', None) is None:
+        return None
+    return artist
+
+def _node(graph, artist, today):
+    key = str(artist.id)
+    node = graph.get(key)
+    if node is None:
+        node = {"name": getattr(artist, 'name', ''), "adj": {}, "tracks": []}
+        graph[key] = node
+    node["seen"] = today
+    return key, node
+
+def observe(tracks, weight=1.0, keep_tracks=True, source=None):
+    """
+    Fold an already-fetched container (mix, playlist, favorites page) into the graph.
+    Artists appearing close together are linked; with keep_tracks, their tracks are
+    remembered as candidates for later graph walks.
+
+    source identifies the container (e.g. "Mix:<id>"). A container whose contents are
+    unchanged since it was last folded in is not counted again; its artists are only
+    marked as seen today, so an unchanged run does not rewrite the file.
+    """
+    global _dirty
+    tracks = [t for t in tracks if hasattr(t, 'id')]
+    if not tracks:
+        return
+
+    today = date.today().isoformat()
+    fingerprint = zlib.crc32(",".join(str(t.id) for t in tracks).encode())
+    with _lock:
+        graph = _load()
+        if source is not None:
+            known = _sources.get(source)
+            if known and known[0] == fingerprint:
+                for t in tracks:
+                    artist = _artist_of(t)
+                    node = graph.get(str(artist.id)) if artist is not None else None
+                    if node is not None and node.get("seen") != today:
+                        node["seen"] = today
+                        _dirty = True
+                if known[1] != today:
+                    known[1] = today
+                    _dirty = True
+                return
+            _sources[source] = [fingerprint, today]
+
+        keys = []
+        for t in tracks:
+            artist = _artist_of(t)
+            if artist is None:
+                keys.append(None)
+                continue
+            key, node = _node(graph, artist, today)
+            keys.append(key)
+            if keep_tracks:
+                album = getattr(t, 'album', None)
+                bpm = getattr(t, 'bpm', None)
+                entry = [t.id, getattr(t, 'name', ''),
+                         getattr(album, 'id', None), getattr(album, 'name', None),
+                         bpm if isinstance(bpm, (int, float)) else None]
+                node["tracks"] = [e for e in node["tracks"] if e[0] != t.id] + [entry]
+                del node["tracks"][:-MAX_TRACKS]
+
+        touched = set()
+        for i, a in enumerate(keys):
+            if a is None:
+                continue
+            for b in keys[i + 1:i + 1 + WINDOW]:
+                if b is None or b == a:
+                    continue
+                graph[a]["adj"][b] = graph[a]["adj"].get(b, 0) + weight
+                graph[b]["adj"][a] = graph[b]["adj"].get(a, 0) + weight
+                touched.update((a, b))
+
+        for key in touched:
+            adj = graph[key]["adj"]
+            if len(adj) > MAX_NEIGHBORS:
+                strongest = sorted(adj.items(), key=lambda kv: kv[1], reverse=True)[:MAX_NEIGHBORS]
+                graph[key]["adj"] = dict(strongest)
+        _dirty = True
+
+def save():
+    """Persist the graph (pruned to MAX_ARTISTS / MAX_AGE_DAYS) if anything changed this run."""
+    global _dirty
+    with _lock:
+        if not _dirty or _graph is None:
+            return
+        _prune(_graph)
+        try:
+            with open(GRAPH_FILE, 'w') as f:
+                json.dump({"artists": _graph, "sources": _sources}, f, separators=(',', ':'))
+            _dirty = False
+        except Exception as e:
+            print(f"Warning: Could not save artist graph: {e}")
+
+def save_async():
+    """Persist on a background thread; returns it so the caller can join()."""
+    t = threading.Thread(target=save, name="artist-graph-writer")
+    t.start()
+    return t
+
+def expand(seed_artist_ids, count, exclude_ids=()):
+    """
+    Adventure candidates from a local two-hop walk around the seed artists.
+    Neighbors are ranked by summed edge weight (second hop decayed); seed artists
+    themselves and excluded track ids are skipped. No API calls are made.
+    """
+    with _lock:
+        graph = _load()
+        seeds = {str(a) for a in seed_artist_ids if a is not None}
+
+        scores = {}
+        for seed in seeds:
+            node = graph.get(seed)
+            if not node:
+                continue
+            for n1, w1 in node["adj"].items():
+                scores[n1] = scores.get(n1, 0) + w1
+                for n2, w2 in graph.get(n1, {}).get("adj", {}).items():
+                    scores[n2] = scores.get(n2, 0) + HOP_DECAY * min(w1, w2)
+
+        ranked = [a for a, _ in sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+                  if a not in seeds and graph.get(a, {}).get("tracks")]
+
+        # Round-robin over the best artists so one neighbor does not dominate
+        exclude = set(exclude_ids)
+        pools = [(a, list(reversed(graph[a]["tracks"]))) for a in ranked]
+        results = []
+        while len(results) < count and pools:
+            next_pools = []
+            for a, tracks in pools:
+                while tracks:
+                    tid, name, album_id, album_name, bpm = tracks.pop(0)
+                    if tid not in exclude:
+                        exclude.add(tid)
+                        results.append(IndexedTrack(tid, name, int(a) if a.isdigit() else a,
+                                                    graph[a]["name"], album_id, album_name, bpm))
+                        break
+                if tracks:
+                    next_pools.append((a, tracks))
+                if len(results) >= count:
+                    break
+            pools = next_pools
+        return results
@@ -0,0 +1,141 @@
+import random
+
+# Registries: new buckets plug in by name from config, without touching the core loop.
+# source(session, need, spec) -> list of candidate tracks
+# predicate(track, spec) -> bool
+SOURCES = {}
+PREDICATES = {}
+
+def register_source(name):
+    """Decorator registering a candidate source usable as a bucket's "source"."""
+    def wrap(fn):
+        SOURCES[name] = fn
+        return fn
+    return wrap
+
+def register_predicate(name):
+    """Decorator registering a filter usable as a bucket's "predicate"."""
+    def wrap(fn):
+        PREDICATES[name] = fn
+        return fn
+    return wrap
+
+@register_predicate("any")
+def _any(track, spec):
+    return True
+
+def allocate(weights, limit):
+    """Split limit across buckets proportionally (largest remainder), summing exactly to limit."""
+    total = float(sum(weights))
+    if total <= 0:
+        return [0] * len(weights)
+    raw = [limit * w / total for w in weights]
+    targets = [int(r) for r in raw]
+    short = limit - sum(targets)
+    by_remainder = sorted(range(len(weights)), key=lambda i: raw[i] - targets[i], reverse=True)
+    for i in by_remainder[:short]:
+        targets[i] += 1
+    return targets
+
+def fill_buckets(session, specs, limit, log=print):
+    """
+    Build each bucket from its source and predicate, then backfill short buckets
+    from everything left over. Returns a list of (spec, tracks) pairs.
+    """
+    weights = [max(0.0, float(spec.get("weight", 0))) for spec in specs]
+    targets = allocate(weights, limit)
+
+    used_ids = set()
+    leftovers = []
+    filled = []
+
+    for spec, target in zip(specs, targets):
+        name = spec.get("name", spec.get("source", "bucket"))
+        source = SOURCES.get(spec.get("source"))
+        predicate = PREDICATES.get(spec.get("predicate", "any"))
+        if source is None or predicate is None:
+            log(f"- Warning: Bucket '{name}' has unknown source/predicate, skipping.")
+            filled.append((spec, [], target))
+            continue
+        if target <= 0:
+            # Weight 0 (or rounded away): don't pay for remote fetches nobody uses
+            log(f"- {name}: no tracks allocated, skipping.")
+            filled.append((spec, [], target))
+            continue
+
+        try:
+            candidates = source(session, target, spec)
+        except Exception as e:
+            log(f"- Error fetching source '{spec.get('source')}' for {name}: {e}")
+            candidates = []
+
+        matches, others = [], []
+        for t in candidates:
+            if not hasattr(t, 'id') or t.id in used_ids:
+                continue
+            (matches if predicate(t, spec) else others).append(t)
+        random.shuffle(matches)
+        random.shuffle(others)
+
+        # Prioritize matches, fill with the rest of the same source if allowed
+        bucket = matches[:target]
+        spare = matches[target:]
+        if spec.get("fallback", False) and len(bucket) < target:
+            needed = target - len(bucket)
+            bucket.extend(others[:needed])
+            spare.extend(others[needed:])
+        else:
+            spare.extend(others)
+
+        log(f"- {name}: {len(matches)} matching of {len(candidates)} candidates")
+        used_ids.update(t.id for t in bucket)
+        leftovers.extend(spare)
+        filled.append((spec, bucket, target))
+
+    # Backfill if any bucket is short
+    # Simple pool to draw from for backfill: everything distinct not yet used
+    pool = []
+    for t in leftovers:
+        if t.id not in used_ids:
+            used_ids.add(t.id)
+            pool.append(t)
+    random.shuffle(pool)
+
+    result = []
+    for spec, bucket, target in filled:
+        name = spec.get("name", "bucket")
+        needed = target - len(bucket)
+        if needed > 0:
+            log(f"- {name} bucket short by {needed}, backfilling...")
+            while needed > 0 and pool:
+                bucket.append(pool.pop())
+                needed -= 1
+            if needed > 0:
+                log(f"  Warning: Could not fully backfill {name}.")
+        result.append((spec, bucket))
+    return result
+
+def interleave(buckets, rng=random):
+    """
+    Merge buckets into one sequence by smooth weighted round-robin.
+    Every slot credits each bucket with its size and plays the bucket with the most
+    credit, which then pays back the total. Each bucket comes up in proportion to its
+    size and evenly spread, with no long runs from one bucket and no single-bucket
+    tail. Ties go to a random bucket order, so runs differ between generations.
+    """
+    queues = [list(b) for b in buckets if b]
+    rng.shuffle(queues)
+    weights = [len(q) for q in queues]
+    total = sum(weights)
+    credit = [0] * len(queues)
+    positions = [0] * len(queues)
+    final_list = []
+
+    while len(final_list) < total:
+        for i, w in enumerate(weights):
+            credit[i] += w
+        i = max(range(len(queues)), key=lambda k: credit[k])
+        credit[i] -= total
+        final_list.append(queues[i][positions[i]])
+        positions[i] += 1
+    return final_list
@@ -0,0 +1,181 @@
+import json
+import math
+import time
+from datetime import datetime, timedelta, timezone
+import tidalapi
+import auth_manager
+
+# Constants
+CAPABILITIES_FILE = auth_manager.CONFIG_DIR / 'capabilities.json'
+MAX_AGE_DAYS = 30
+SAMPLES = 20
+MIN_P95_SAMPLES = 20  # Below this, p95 is just the max; report it as such
+PAGE_SIZE = 100
+
+_capabilities = None
+
+def _tidalapi_version():
+    return getattr(tidalapi, '__version__', 'unknown')
+
+def load_capabilities():
+    """
+    Cached capability results from the last `doctor` run.
+    Returns {} if missing, older than MAX_AGE_DAYS, or recorded with another tidalapi version.
+    """
+    global _capabilities
+    if _capabilities is not None:
+        return _capabilities
+
+    _capabilities = {}
+    if CAPABILITIES_FILE.exists():
+        try:
+            with open(CAPABILITIES_FILE, 'r') as f:
+                data = json.load(f)
+            checked = datetime.fromisoformat(data["checked_at"])
+            fresh = datetime.now(timezone.utc) - checked < timedelta(days=MAX_AGE_DAYS)
+            if fresh and data.get("tidalapi_version") == _tidalapi_version():
+                _capabilities = data.get("capabilities", {})
+        except Exception as e:
+            print(f"Warning: Could not read capabilities cache: {e}")
+    return _capabilities
+
+def has(capability, default=True):
+    """
+    Whether a fast path is known to be supported.
+    Unknown capabilities return default, so callers keep their try/fallback behaviour.
+    """
+    return load_capabilities().get(capability, default)
+
+def _percentile(values, pct):
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+def _summary(latencies, items):
+    """p50 plus p95 (or max, when there are too few samples for p95 to mean anything)."""
+    tail = "p95" if len(latencies) >= MIN_P95_SAMPLES else "max"
+    tail_value = _percentile(latencies, 95) if tail == "p95" else max(latencies)
+    return {"p50": round(_percentile(latencies, 50), 1), tail: round(tail_value, 1), "items": items}
+
+def _measure(fn, samples=SAMPLES):
+    """Call fn `samples` times; returns (latencies in ms, last result)."""
+    latencies = []
+    result = None
+    for _ in range(samples):
+        t = time.perf_counter()
+        result = fn()
+        latencies.append((time.perf_counter() - t) * 1000)
+    return latencies, result
+
+def _accepts(fn, **kwargs):
+    """True if fn accepts the given keyword arguments (probed with a real call)."""
+    try:
+        fn(**kwargs)
+        return True
+    except TypeError:
+        return False
+    except Exception:
+        # Supported signature, failed for another reason
+        return True
+
+def _find_user_playlist(session):
+    try:
+        for pl in session.user.playlists():
+            if hasattr(pl, 'add'):
+                return pl
+    except Exception:
+        pass
+    return None
+
+def run(session, samples=SAMPLES):
+    """
+    Probe each endpoint Tidal Fusion depends on, report latency/page sizes and
+    detect available fast paths. Results are cached in CAPABILITIES_FILE.
+    """
+    global _capabilities
+    user = session.user
+    favs = user.favorites
+
+    probes = [
+        ("favorites.tracks", lambda: list(favs.tracks(limit=PAGE_SIZE, offset=0))),
+        ("favorites.playlists", lambda: list(favs.playlists())),
+        ("user.playlists", lambda: list(user.playlists())),
+        ("history", lambda: list(user.history(limit=PAGE_SIZE, offset=0))),
+        ("mixes", lambda: list(session.mixes())),
+    ]
+
+    print(f"Tidal Fusion Doctor (tidalapi {_tidalapi_version()}, {samples} samples per endpoint)")
+    tail = "p95" if samples >= MIN_P95_SAMPLES else "max"
+    print(f"{'Endpoint':<24}{'p50 ms':>10}{tail + ' ms':>10}{'items':>8}")
+
+    latency = {}
+    results = {}
+    for name, fn in probes:
+        try:
+            lat, result = _measure(fn, samples)
+        except Exception as e:
+            print(f"{name:<24}{'error':>10}  {e}")
+            latency[name] = None
+            continue
+        results[name] = result
+        latency[name] = _summary(lat, len(result))
+        print(f"{name:<24}{latency[name]['p50']:>10}{latency[name][tail]:>10}{len(result):>8}")
+
+    # Container contents (first mix)
+    mixes = results.get("mixes") or []
+    if mixes:
+        mix = mixes[0]
+        try:
+            lat, result = _measure(lambda: list(mix.items()), samples)
+            latency["mix.items"] = _summary(lat, len(result))
+            print(f"{'mix.items':<24}{latency['mix.items']['p50']:>10}{latency['mix.items'][tail]:>10}{len(result):>8}")
+        except Exception as e:
+            print(f"{'mix.items':<24}{'error':>10}  {e}")
+
+    # Capabilities
+    tracks = results.get("favorites.tracks") or []
+    sample_pl = _find_user_playlist(session)
+    # Check the class as well, so an account without playlists still gets an answer
+    playlist_cls = type(sample_pl) if sample_pl is not None else getattr(tidalapi, 'UserPlaylist', None)
+
+    try:
+        from tidalapi.types import ItemOrder, OrderDirection
+        order_ok = _accepts(favs.tracks, limit=1, offset=0, order=ItemOrder.Date, order_direction=OrderDirection.Descending)
+    except ImportError:
+        order_ok = False
+
+    caps = {
+        "paging": _accepts(favs.tracks, limit=1, offset=0),
+        "favorites_order": order_ok,
+        "tracks_count": hasattr(favs, 'get_tracks_count'),
+    }
+    # Only record what could actually be observed; unknowns keep their runtime fallbacks
+    if tracks:
+        caps["bpm"] = any(getattr(t, 'bpm', None) for t in tracks)
+        caps["audio_features"] = any(hasattr(t, 'audio_features') for t in tracks) or hasattr(session, 'get_audio_features')
+    if playlist_cls is not None:
+        caps["bulk_clear"] = hasattr(playlist_cls, 'clear')
+        caps["bulk_remove"] = hasattr(playlist_cls, 'remove_by_indices')
+        caps["remove_by_id"] = hasattr(playlist_cls, 'remove_by_id')
+        caps["edit_metadata"] = hasattr(playlist_cls, 'edit')
+
+    print("\nCapabilities:")
+    for name, ok in caps.items():
+        print(f"  [ {'x' if ok else ' '} ] {name}")
+
+    data = {
+        "checked_at": datetime.now(timezone.utc).isoformat(),
+        "tidalapi_version": _tidalapi_version(),
+        "capabilities": caps,
+        "latency": latency
+    }
+    try:
+        with open(CAPABILITIES_FILE, 'w') as f:
+            json.dump(data, f, indent=4)
+        print(f"\nCapabilities cached to {CAPABILITIES_FILE}")
+    except Exception as e:
+        print(f"Error saving capabilities: {e}")
+
+    _capabilities = caps
+    return data
@@ -0,0 +1,167 @@
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import auth_manager
+
+# Constants
+HISTORY_DIR = auth_manager.CONFIG_DIR / 'history'
+ACTIVE_FILE = HISTORY_DIR / 'history.jsonl.gz'
+SEGMENT_PREFIX = 'history-'
+DEFAULT_MAX_BYTES = 1024 * 1024  # Rotate the active file after ~1 MB (compressed)
+DEFAULT_MAX_AGE_DAYS = 180       # Drop rotated segments older than this
+
+_write_lock = threading.Lock()
+
+def track_artist_name(track):
+    """Best-effort artist name for a tidalapi track."""
+    artist = getattr(track, 'artist', None)
+    if artist:
+        return artist.name
+    # sometimes track.artists is a list
+    artists = getattr(track, 'artists', [])
+    return ", ".join([a.name for a in artists]) if artists else "Unknown Artist"
+
+def build_record(tracks, mode, buckets=None, timings=None):
+    """
+    Build a single history record (one line of JSONL) for a generation run.
+    buckets maps track id -> bucket name (Fusion mode).
+    """
+    buckets = buckets or {}
+    entries = []
+    for track in tracks:
+        bpm = getattr(track, 'bpm', None)
+        try:
+            bpm = int(bpm) if bpm else None
+        except (TypeError, ValueError):
+            bpm = None
+        entries.append({
+            "id": track.id,
+            "artist": track_artist_name(track),
+            "title": getattr(track, 'name', 'Unknown Title'),
+            "bucket": buckets.get(track.id),
+            "bpm": bpm
+        })
+
+    return {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "mode": mode,
+        "count": len(entries),
+        "timings": {k: round(v, 3) for k, v in (timings or {}).items()},
+        "tracks": entries
+    }
+
+def _segments():
+    """Return all history files (rotated segments and the active file), oldest first."""
+    if not HISTORY_DIR.exists():
+        return []
+    files = sorted(HISTORY_DIR.glob(f"{SEGMENT_PREFIX}*.jsonl.gz"))
+    if ACTIVE_FILE.exists():
+        files.append(ACTIVE_FILE)
+    return files
+
+def rotate(max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Size-based rotation of the active file and age-based pruning of old segments.
+    Segments are append-only, so a segment's mtime is the time of its newest record.
+    """
+    if ACTIVE_FILE.exists() and ACTIVE_FILE.stat().st_size >= max_bytes:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        ACTIVE_FILE.rename(HISTORY_DIR / f"{SEGMENT_PREFIX}{stamp}.jsonl.gz")
+
+    cutoff = time.time() - max_age_days * 86400
+    for seg in HISTORY_DIR.glob(f"{SEGMENT_PREFIX}*.jsonl.gz"):
+        if seg.stat().st_mtime < cutoff:
+            try:
+                seg.unlink()
+            except OSError as e:
+                print(f"Warning: Could not prune history segment {seg.name}: {e}")
+
+def append(record, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Append a record to the active file.
+    Each append is its own gzip member; readers see one concatenated stream.
+    """
+    with _write_lock:
+        HISTORY_DIR.mkdir(parents=True, exist_ok=True)
+        with gzip.open(ACTIVE_FILE, 'at', encoding='utf-8') as f:
+            f.write(json.dumps(record, separators=(',', ':')) + "\n")
+        rotate(max_bytes, max_age_days)
+
+def append_async(record, max_bytes=DEFAULT_MAX_BYTES, max_age_days=DEFAULT_MAX_AGE_DAYS):
+    """
+    Write the record on a background thread so it stays off the critical path.
+    Returns the thread; join() it before exiting to guarantee the write lands.
+    """
+    def worker():
+        try:
+            append(record, max_bytes, max_age_days)
+        except Exception as e:
+            print(f"Error writing history: {e}")
+
+    t = threading.Thread(target=worker, name="history-writer")
+    t.start()
+    return t
+
+def iter_records(since=None):
+    """
+    Yield history records, oldest first.
+    If since (aware datetime) is given, whole segments last written before it are skipped unread.
+    """
+    since_ts = since.timestamp() if since else None
+    for seg in _segments():
+        if since_ts is not None and seg.stat().st_mtime < since_ts:
+            continue
+        try:
+            with gzip.open(seg, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    rec = json.loads(line)
+                    if since is not None and datetime.fromisoformat(rec["ts"]) < since:
+                        continue
+                    yield rec
+        except (OSError, EOFError, ValueError) as e:
+            # A truncated member (e.g. interrupted write) should not hide the rest
+            print(f"Warning: Skipping unreadable history data in {seg.name}: {e}")
+
+def query(track_id=None, days=30, top=20):
+    """
+    Summarize history for the last `days` days.
+    With track_id: how many runs served it (and via which buckets).
+    Without: the most frequently served tracks.
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    runs = 0
+    served = {}
+    meta = {}
+    bucket_counts = {}
+
+    for rec in iter_records(since):
+        runs += 1
+        for entry in rec.get("tracks", []):
+            tid = str(entry.get("id"))
+            if track_id is not None and tid != str(track_id):
+                continue
+            served[tid] = served.get(tid, 0) + 1
+            meta[tid] = entry
+            if track_id is not None:
+                b = entry.get("bucket") or "none"
+                bucket_counts[b] = bucket_counts.get(b, 0) + 1
+
+    print(f"History: {runs} runs in the last {days} days.")
+    if track_id is not None:
+        count = served.get(str(track_id), 0)
+        entry = meta.get(str(track_id))
+        label = f"{entry['artist']} - {entry['title']}" if entry else str(track_id)
+        print(f"  {label}: served {count} times")
+        if bucket_counts:
+            print("  Buckets: " + ", ".join(f"{b}: {n}" for b, n in sorted(bucket_counts.items())))
+        return count
+
+    ranked = sorted(served.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    for tid, count in ranked:
+        entry = meta[tid]
+        print(f"  {count:4d}x  {entry['artist']} - {entry['title']} (ID: {tid})")
+    return ranked
@@ -0,0 +1,103 @@
+import json
+import threading
+import auth_manager
+
+# Constants
+STATE_FILE = auth_manager.CONFIG_DIR / 'playlist_state.json'
+PAGE_SIZE = 100
+
+_lock = threading.Lock()
+
+def _load_all():
+    if not STATE_FILE.exists():
+        return {}
+    try:
+        with open(STATE_FILE, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Warning: Could not read playlist state, rebuilding: {e}")
+        return {}
+
+def _save_all(data):
+    try:
+        with open(STATE_FILE, 'w') as f:
+            json.dump(data, f)
+    except Exception as e:
+        print(f"Warning: Could not save playlist state: {e}")
+
+def _fingerprint(playlist):
+    """Last-known server state of a playlist, available without fetching its items."""
+    last_updated = getattr(playlist, 'last_updated', None)
+    return {
+        "num_tracks": getattr(playlist, 'num_tracks', None),
+        "last_updated": last_updated.isoformat() if hasattr(last_updated, 'isoformat') else last_updated
+    }
+
+def fetch_track_ids(playlist, page_size=PAGE_SIZE):
+    """Full, ordered list of track ids in a playlist (paged items() walk)."""
+    ids = []
+    offset = 0
+    while True:
+        try:
+            page = playlist.items(limit=page_size, offset=offset)
+        except TypeError:
+            return [t.id for t in playlist.items() if hasattr(t, 'id')]
+        ids.extend(t.id for t in page if hasattr(t, 'id'))
+        if len(page) < page_size:
+            return ids
+        offset += page_size
+
+def load_members(playlist):
+    """
+    Ordered track ids of the playlist (oldest first).
+    Served from the local cache when the playlist's track count and last-updated
+    time still match what we recorded; otherwise rebuilt with one paged items() walk.
+    """
+    with _lock:
+        entry = _load_all().get(str(playlist.id))
+
+    fp = _fingerprint(playlist)
+    if entry and fp["num_tracks"] is not None and fp["last_updated"] is not None \
+            and entry.get("num_tracks") == fp["num_tracks"] \
+            and entry.get("last_updated") == fp["last_updated"] \
+            and len(entry.get("ids", [])) == fp["num_tracks"]:
+        print(f"- Using cached membership ({len(entry['ids'])} tracks).")
+        return list(entry["ids"])
+
+    print("- Membership cache stale or missing, fetching playlist contents...")
+    ids = fetch_track_ids(playlist)
+    save_members(playlist, ids)
+    return ids
+
+def save_members(playlist, ids, session=None):
+    """
+    Record the playlist's current membership together with its fingerprint.
+    After our own writes the playlist object is stale, so pass the session to
+    re-read its metadata first. If the server state cannot be confirmed to match
+    ids, the entry is dropped instead and the next run rebuilds it.
+    """
+    playlist_id = playlist.id
+    if session is not None:
+        try:
+            playlist = session.playlist(playlist_id)
+        except Exception as e:
+            print(f"- Warning: Could not refresh playlist metadata ({e}).")
+            playlist = None
+
+    fp = _fingerprint(playlist) if playlist is not None else None
+    if fp is None or fp["num_tracks"] != len(ids) or fp["last_updated"] is None:
+        forget(playlist_id)
+        return False
+
+    with _lock:
+        data = _load_all()
+        data[str(playlist_id)] = {"ids": list(ids), **fp}
+        _save_all(data)
+    return True
+
+def forget(playlist_id):
+    """Drop cached state, e.g. after a failed write or when the playlist is deleted."""
+    with _lock:
+        data = _load_all()
+        if data.pop(str(playlist_id), None) is not None:
+            _save_all(data)
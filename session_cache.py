@@ -0,0 +1,67 @@
+import threading
+import weakref
+from concurrent.futures import Future
+
+class RequestCache:
+    """
+    Per-run memoization of remote requests.
+    Identical keys are fetched at most once; concurrent callers asking for a key
+    that is already in flight wait for the first request instead of issuing their own.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, fetch):
+        """Return the cached result for key, calling fetch() only if nobody has yet."""
+        with self._lock:
+            fut = self._entries.get(key)
+            if fut is not None:
+                self.hits += 1
+                owner = False
+            else:
+                fut = Future()
+                self._entries[key] = fut
+                self.misses += 1
+                owner = True
+
+        if not owner:
+            return fut.result()
+
+        try:
+            result = fetch()
+        except BaseException as e:
+            # Don't cache failures: waiters get the error, later callers may retry
+            with self._lock:
+                self._entries.pop(key, None)
+            fut.set_exception(e)
+            raise
+        fut.set_result(result)
+        return result
+
+    def invalidate(self, key=None):
+        """Drop one key (or everything) so the next request goes to the network."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+_caches = weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+def cache_for(session):
+    """The RequestCache bound to this session (one session per run)."""
+    with _caches_lock:
+        cache = _caches.get(session)
+        if cache is None:
+            cache = RequestCache()
+            _caches[session] = cache
+        return cache
+
+def cached(session, key, fetch):
+    """Shorthand for cache_for(session).get(key, fetch)."""
+    return cache_for(session).get(key, fetch)
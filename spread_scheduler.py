@@ -0,0 +1,152 @@
+import heapq
+from collections import deque
+
+DEFAULT_ARTIST_GAP = 3  # Minimum other tracks between two by the same artist
+DEFAULT_ALBUM_GAP = 5   # Minimum other tracks between two from the same album
+
+def _artist_key(track):
+    artist = getattr(track, 'artist', None)
+    if artist is None:
+        artists = getattr(track, 'artists', None) or []
+        artist = artists[0] if artists else None
+    if artist is None:
+        return None
+    return getattr(artist, 'id', None) or getattr(artist, 'name', None)
+
+def _album_key(track):
+    album = getattr(track, 'album', None)
+    if album is None:
+        return None
+    return getattr(album, 'id', None) or getattr(album, 'name', None)
+
+def conflicts_at(tracks, pos, artist_gap=DEFAULT_ARTIST_GAP, album_gap=DEFAULT_ALBUM_GAP):
+    """True if tracks[pos] repeats an artist/album of a neighbor within the given gaps."""
+    artist = _artist_key(tracks[pos])
+    album = _album_key(tracks[pos])
+    for other in range(max(0, pos - max(artist_gap, album_gap)), min(len(tracks), pos + max(artist_gap, album_gap) + 1)):
+        if other == pos:
+            continue
+        dist = abs(other - pos)
+        if artist is not None and dist <= artist_gap and _artist_key(tracks[other]) == artist:
+            return True
+        if album is not None and dist <= album_gap and _album_key(tracks[other]) == album:
+            return True
+    return False
+
+def schedule(tracks, artist_gap=DEFAULT_ARTIST_GAP, album_gap=DEFAULT_ALBUM_GAP):
+    """
+    Reorder tracks so the same artist/album does not repeat within the given gaps.
+    Tracks keep their input order wherever the constraints allow.
+
+    Each pass (_schedule_pass) plays tracks in input order and pulls one forward only
+    when its artist's or album's remaining tracks would otherwise no longer fit their
+    gaps before the end. If that still leaves conflicts, the pass is repeated pulling
+    crowded artists/albums forward earlier (lead doubles each time), and the pass with
+    the fewest conflicts wins. Each pass is O(n log n); there are at most O(log n).
+
+    Returns (ordered_tracks, violations), where violations counts placements that had
+    to break a gap because nothing else was left to play.
+    """
+    n = len(tracks)
+    best = _schedule_pass(tracks, artist_gap, album_gap, 0)
+    lead = max(artist_gap, album_gap) + 1
+    while best[1] and lead < 2 * n:
+        attempt = _schedule_pass(tracks, artist_gap, album_gap, lead)
+        if attempt[1] < best[1]:
+            best = attempt
+        lead *= 2
+    return best
+
+def _schedule_pass(tracks, artist_gap, album_gap, lead):
+    """
+    One greedy pass. Tracks are grouped per artist and only each group's head is
+    scheduled, via two heaps: `waiting` keyed by next-allowed position and `ready`
+    keyed by input position, or by the head's deadline minus lead if that is earlier.
+    """
+    groups = {}
+    order = []
+    for idx, t in enumerate(tracks):
+        key = _artist_key(t)
+        if key is None:
+            key = ("track", idx)  # Unknown artist: unconstrained
+        if key not in groups:
+            groups[key] = deque()
+            order.append(key)
+        groups[key].append((idx, t))
+
+    n = len(tracks)
+    album_left = {}
+    for t in tracks:
+        album = _album_key(t)
+        if album is not None:
+            album_left[album] = album_left.get(album, 0) + 1
+
+    last_artist = {}
+    last_album = {}
+
+    def allowed_at(key, track):
+        pos = 0
+        if key in last_artist:
+            pos = last_artist[key] + artist_gap + 1
+        album = _album_key(track)
+        if album is not None and album in last_album:
+            pos = max(pos, last_album[album] + album_gap + 1)
+        return pos
+
+    def priority(key):
+        # Deadline: the latest start that still leaves room for the remaining tracks of
+        # the artist/album. Album counts drop when other artists play the album, so a
+        # stored priority can only be too early; it is re-checked when popped.
+        # The head's input index breaks ties (keys may not be comparable).
+        idx, track = groups[key][0]
+        deadline = n - 1 - (len(groups[key]) - 1) * (artist_gap + 1)
+        album = _album_key(track)
+        if album is not None:
+            deadline = min(deadline, n - 1 - (album_left[album] - 1) * (album_gap + 1))
+        return (min(idx, deadline - lead), idx)
+
+    ready = []
+    waiting = []
+    for key in order:
+        heapq.heappush(ready, (priority(key), key))
+
+    result = []
+    violations = 0
+
+    for pos in range(n):
+        while waiting and waiting[0][0] <= pos:
+            _, _, key = heapq.heappop(waiting)
+            heapq.heappush(ready, (priority(key), key))
+
+        chosen = None
+        while ready:
+            prio, key = heapq.heappop(ready)
+            current = priority(key)
+            if current != prio:
+                heapq.heappush(ready, (current, key))
+                continue
+            at = allowed_at(key, groups[key][0][1])
+            if at <= pos:
+                chosen = key
+                break
+            # Blocked by an album placed by another artist since it became ready
+            heapq.heappush(waiting, (at, prio, key))
+
+        if chosen is None:
+            # Everything left is blocked: take the one that becomes free soonest
+            _, _, chosen = heapq.heappop(waiting)
+            violations += 1
+
+        _, track = groups[chosen].popleft()
+        result.append(track)
+        last_artist[chosen] = pos
+        album = _album_key(track)
+        if album is not None:
+            last_album[album] = pos
+            album_left[album] -= 1
+
+        if groups[chosen]:
+            nxt = groups[chosen][0][1]
+            heapq.heappush(waiting, (allowed_at(chosen, nxt), priority(chosen), chosen))
+
+    return result, violations
@@ -1,18 +1,54 @@
 
 import argparse
+import copy
 import json
 import platform
 import pathlib
 import random
 import sys
+import threading
+import time
+from concurrent.futures import Future
 from datetime import datetime, timedelta, timezone
 import tidalapi
+import artist_graph
 import auth_manager
+import bucket_engine
+import doctor
+import history_store
+import playlist_state
+import spread_scheduler
+from bucket_engine import register_predicate, register_source
+from session_cache import cache_for, cached
+
+try:
+    # Favorites ordering is only available in newer tidalapi releases
+    from tidalapi.types import ItemOrder, OrderDirection
+except ImportError:
+    ItemOrder = OrderDirection = None
 
 # Constants
 CONFIG_FILE = auth_manager.CONFIG_DIR / 'tidal_config.json'
 DEFAULT_PLAYLIST_NAME = "Tidal Fusion"
+STAGING_PLAYLIST_NAME = "Tidal Fusion (staging)"
+PLAYLIST_DESCRIPTION = "Generated by Tidal Fusion"
+STAGING_DESCRIPTION = "Tidal Fusion staging buffer - refilled on every staged run"
 MIX_NAMES_GENERATED = [f"My Mix {i}" for i in range(1, 9)]
+PAGE_SIZE = 100
+HISTORY_LIMIT = 100
+COMFORT_CUTOFF_DAYS = 180
+
+# Fusion buckets (see "Fusion Buckets" below)
+DEFAULT_FUSION_BUCKETS = [
+    # Comfort: Favorites > 6 months (approx 180 days)
+    {"name": "Comfort", "label": "Classics", "source": "favorites", "predicate": "older_than",
+     "days": COMFORT_CUTOFF_DAYS, "weight": 0.4, "fallback": True},
+    # Habit: Recent history
+    {"name": "Habit", "label": "Current Rotation", "source": "history", "predicate": "any", "weight": 0.3},
+    # Adventure: Discovery mixes
+    {"name": "Adventure", "label": "New Discoveries", "source": "discovery", "predicate": "any", "weight": 0.3,
+     "expand": True}
+]
 
 # Config Structure Defaults
 DEFAULT_CONFIG = {
@@ -24,15 +60,23 @@ DEFAULT_CONFIG = {
             "my_mixes": True
         },
         "fusion": {
-            # Future fusion config
+            "buckets": DEFAULT_FUSION_BUCKETS
         }
+    },
+    "spread": {
+        "artist_gap": spread_scheduler.DEFAULT_ARTIST_GAP,
+        "album_gap": spread_scheduler.DEFAULT_ALBUM_GAP
+    },
+    "history": {
+        "max_bytes": history_store.DEFAULT_MAX_BYTES,
+        "max_age_days": history_store.DEFAULT_MAX_AGE_DAYS
     }
 }
 
 def load_config():
     """Load config from disk or return default."""
     if not CONFIG_FILE.exists():
-        return DEFAULT_CONFIG.copy()
+        return copy.deepcopy(DEFAULT_CONFIG)
     
     try:
         with open(CONFIG_FILE, 'r') as f:
@@ -40,7 +84,7 @@ def load_config():
             data = json.load(f)
             if "daily_discovery" in data and "modes" not in data:
                 print("Migrating old config format...")
-                new_conf = DEFAULT_CONFIG.copy()
+                new_conf = copy.deepcopy(DEFAULT_CONFIG)
                 new_conf["modes"]["basic"] = {
                     "daily_discovery": data.get("daily_discovery", True),
                     "new_arrivals": data.get("new_arrivals", True),
@@ -51,7 +95,7 @@ def load_config():
             return data
     except Exception as e:
         print(f"Error loading config, using defaults: {e}")
-        return DEFAULT_CONFIG.copy()
+        return copy.deepcopy(DEFAULT_CONFIG)
 
 def save_config(config):
     """Save config to disk."""
@@ -98,14 +142,45 @@ def configure_basic_mode(config):
 
 def configure_fusion_mode(config):
     """Interactive menu for Fusion Mode."""
+    fusion_conf = config["modes"].setdefault("fusion", {})
+    original = copy.deepcopy(fusion_conf)
+    specs = fusion_conf.setdefault("buckets", fusion_buckets(config))
     while True:
         print("\n--- Fusion Mode Configuration ---")
-        print("No configurable options for Fusion mode yet.")
-        print("1. Save and Exit")
-        print("2. Exit without Saving")
+        total = sum(float(spec.get("weight", 0)) for spec in specs) or 1.0
+        for i, spec in enumerate(specs, 1):
+            rule = spec.get("predicate", "any")
+            if "days" in spec:
+                rule += f" {spec['days']}d"
+            print(f"{i}. {spec.get('name')}: {float(spec.get('weight', 0)) / total:.0%} ({spec.get('source')}, {rule})")
+        n = len(specs)
+        print(f"{n + 1}. Reset to Defaults")
+        print(f"{n + 2}. Save and Exit")
+        print(f"{n + 3}. Exit without Saving")
         
         choice = input("Enter choice: ").strip()
-        if choice in ['1', '2']:
+        if choice.isdigit() and 1 <= int(choice) <= n:
+            spec = specs[int(choice) - 1]
+            w = input(f"Weight for {spec.get('name')} (current {spec.get('weight')}): ").strip()
+            if w:
+                try:
+                    spec["weight"] = max(0.0, float(w))
+                except ValueError:
+                    print("Invalid weight.")
+            if "days" in spec:
+                d = input(f"Cutoff days (current {spec['days']}): ").strip()
+                if d:
+                    try:
+                        spec["days"] = int(d)
+                    except ValueError:
+                        print("Invalid number of days.")
+        elif choice == str(n + 1):
+            specs[:] = copy.deepcopy(DEFAULT_FUSION_BUCKETS)
+        elif choice == str(n + 2):
+            return
+        elif choice == str(n + 3):
+            fusion_conf.clear()
+            fusion_conf.update(original)
             return
 
 def configure_global(config):
@@ -142,6 +217,148 @@ def configure_global(config):
             return
         
 # --- Fetching Logic ---
+# All remote listings/contents go through the per-run request cache so that
+# fusion's internal basic scan and the later stages never refetch the same container.
+
+def list_favorite_playlists(session):
+    return cached(session, ("favorites.playlists",), lambda: list(session.user.favorites.playlists()))
+
+def list_user_playlists(session):
+    return cached(session, ("user.playlists",), lambda: list(session.user.playlists()))
+
+def list_mixes(session):
+    if not hasattr(session, 'mixes'):
+        return []
+    return cached(session, ("mixes",), lambda: list(session.mixes()))
+
+def fetch_page(session, name, fetch_fn, limit, offset=0, order=None, order_direction=None):
+    """One page of a paged listing, with limit/offset/order pushed down to the API."""
+    kwargs = {"limit": limit, "offset": offset}
+    if order is not None:
+        kwargs["order"] = order
+        kwargs["order_direction"] = order_direction
+    key = (name, limit, offset, str(order), str(order_direction))
+    return cached(session, key, lambda: list(fetch_fn(**kwargs)))
+
+def fetch_paged(session, name, fetch_fn, limit, offset=0, order=None, order_direction=None,
+                predicate=None, page_size=PAGE_SIZE):
+    """
+    Page through a listing until `limit` items matching predicate are in hand.
+    Stops early instead of fetching the whole collection.
+    """
+    results = []
+    while len(results) < limit:
+        try:
+            if not doctor.has("paging"):
+                raise TypeError("paging not supported")
+            page = fetch_page(session, name, fetch_fn, page_size, offset, order, order_direction)
+        except TypeError:
+            # Older tidalapi without paging arguments: one full fetch, sliced locally
+            page = cached(session, (name,), lambda: list(fetch_fn()))
+            results.extend(t for t in page[offset:] if predicate is None or predicate(t))
+            break
+        results.extend(t for t in page if predicate is None or predicate(t))
+        if len(page) < page_size:
+            break
+        offset += page_size
+    return results[:limit]
+
+def fetch_history(session, limit=HISTORY_LIMIT, offset=0):
+    """Most recent history tracks, stopping as soon as `limit` are found."""
+    # Ensure we have a list of tracks, sometimes history items are not full tracks
+    return fetch_paged(session, "history", session.user.history, limit, offset,
+                       predicate=lambda t: hasattr(t, 'id'), page_size=min(limit, PAGE_SIZE))
+
+def track_date_added(track):
+    """Timezone-aware date the track was favorited, or None."""
+    # Often it is t.date_added (datetime)
+    d = getattr(track, 'date_added', None) or getattr(track, 'user_date_added', None)
+    if d and d.tzinfo is None:
+        d = d.replace(tzinfo=timezone.utc)
+    return d
+
+def sample_favorite_tracks(session, want_old, cutoff, page_size=PAGE_SIZE):
+    """
+    Sample favorites instead of fetching the whole library, until `want_old`
+    favorites added before cutoff are collected.
+    With newest-first ordering, old favorites sit in the tail: the last few pages are
+    visited first (shuffled among themselves), then the rest from the tail towards the
+    head. Without a known order, pages are visited at uniformly random offsets.
+    """
+    favs = session.user.favorites
+    order = direction = None
+    if ItemOrder and doctor.has("favorites_order"):
+        order = getattr(ItemOrder, 'Date', None)
+        direction = getattr(OrderDirection, 'Descending', None)
+
+    total = None
+    if hasattr(favs, 'get_tracks_count'):
+        try:
+            total = int(favs.get_tracks_count())
+        except Exception:
+            total = None
+
+    if total and order is not None and direction is not None:
+        offsets = list(range(0, total, page_size))
+        tail_pages = max(2, 2 * -(-want_old // page_size))
+        head, tail = offsets[:-tail_pages], offsets[-tail_pages:]
+        random.shuffle(tail)
+        offsets = tail + head[::-1]
+    elif total:
+        offsets = list(range(0, total, page_size))
+        random.shuffle(offsets)
+    else:
+        offsets = None  # Unknown size: walk pages in order until a short page
+
+    sampled = []
+    old_count = 0
+    page_no = 0
+    while old_count < want_old:
+        if offsets is not None:
+            if page_no >= len(offsets):
+                break
+            offset = offsets[page_no]
+        else:
+            offset = page_no * page_size
+        page_no += 1
+
+        try:
+            if not doctor.has("paging"):
+                raise TypeError("paging not supported")
+            page = fetch_page(session, "favorites.tracks", favs.tracks, page_size, offset, order, direction)
+        except TypeError:
+            # Older tidalapi without paging arguments
+            return cached(session, ("favorites.tracks",), lambda: list(favs.tracks()))
+
+        sampled.extend(page)
+        # Favorites only link artists; their tracks are not Adventure material
+        artist_graph.observe(page, weight=0.5, keep_tracks=False, source=f"favorites:{offset}")
+        old_count += sum(1 for t in page if track_date_added(t) and track_date_added(t) < cutoff)
+        if offsets is None and len(page) < page_size:
+            break
+
+    return sampled
+
+def invalidate_playlist_listings(session):
+    """Forget cached playlist listings after we create or delete a playlist."""
+    cache = cache_for(session)
+    cache.invalidate(("user.playlists",))
+    cache.invalidate(("favorites.playlists",))
+
+def container_items(session, container):
+    """Tracks of a playlist or mix, fetched at most once per run."""
+    def fetch():
+        items = []
+        if hasattr(container, 'tracks') and callable(container.tracks):
+            items = list(container.tracks())
+        elif hasattr(container, 'items') and callable(container.items):
+            items = list(container.items())
+        # Feed the artist graph from data we fetched anyway
+        source = f"{key[1]}:{key[2]}" if hasattr(container, 'id') else None
+        artist_graph.observe(items, source=source)
+        return items
+    key = ("items", type(container).__name__, getattr(container, 'id', id(container)))
+    return cached(session, key, fetch)
 
 def fetch_basic_tracks(session, config):
     """
@@ -162,11 +379,7 @@ def fetch_basic_tracks(session, config):
         if name in target_names:
             print(f"Found '{name}'")
             try:
-                items = []
-                if hasattr(container, 'tracks') and callable(container.tracks):
-                    items = container.tracks()
-                elif hasattr(container, 'items') and callable(container.items):
-                    items = container.items()
+                items = container_items(session, container)
                 
                 count = 0
                 for track in items:
@@ -179,153 +392,133 @@ def fetch_basic_tracks(session, config):
 
     # Scan Favorites
     try:
-        for pl in session.user.favorites.playlists():
+        for pl in list_favorite_playlists(session):
             process_container(pl)
     except Exception as e:
         print(f"Error scanning favorites: {e}")
 
     # Scan Mixes
     try:
-        if hasattr(session, 'mixes'):
-            for mix in session.mixes():
-                process_container(mix)
+        for mix in list_mixes(session):
+            process_container(mix)
     except:
         pass
 
     return list(found_tracks.values())
 
-def fetch_fusion_tracks(session, config, limit=200):
-    """
-    Fetch and interleave tracks for 'Fusion' mode.
-    Fusion logic: Comfort (40%), Habit (30%), Adventure (30%).
-    """
-    print(f"Fusion Mode: Generating {limit} tracks...")
-    
-    # 1. Fetch Candidates
-    favorites = []
-    try:
-        favorites = session.user.favorites.tracks()
-        print(f"- Fetched {len(favorites)} Favorites")
-    except Exception:
-        print("- Error fetching Favorites")
+# --- Fusion Buckets ---
+# Buckets are described in config (modes.fusion.buckets) and built by bucket_engine.
+# New sources/predicates register themselves here by name.
 
-    history = []
-    try:
-        # history() might return an iterator or list
-        history = session.user.history()
-        # Ensure we have a list of tracks, sometimes history items are not full tracks
-        history = [t for t in history if hasattr(t, 'id')][:100] 
-        print(f"- Fetched {len(history)} History items")
-    except Exception:
-        print("- Error fetching History")
-        
-    discovery = []
+def fusion_buckets(config):
+    """Bucket specs from config, or the default Comfort/Habit/Adventure split."""
+    specs = config.get("modes", {}).get("fusion", {}).get("buckets")
+    return specs if specs else copy.deepcopy(DEFAULT_FUSION_BUCKETS)
+
+def _cutoff(spec):
+    return datetime.now(timezone.utc) - timedelta(days=spec.get("days", COMFORT_CUTOFF_DAYS))
+
+@register_source("favorites")
+def _source_favorites(session, need, spec):
+    # Sample twice what the bucket needs so the shuffle still has variety
+    favorites = sample_favorite_tracks(session, need * 2, _cutoff(spec))
+    print(f"- Fetched {len(favorites)} Favorites")
+    return favorites
+
+@register_source("history")
+def _source_history(session, need, spec):
+    # History is usually recency sorted. Take the last 100 (or more if the bucket is larger)
+    # and let the engine shuffle, so it is not just the absolute last listened.
+    history = fetch_history(session, max(spec.get("limit", HISTORY_LIMIT), need))
+    print(f"- Fetched {len(history)} History items")
+    return history
+
+@register_source("discovery")
+def _source_discovery(session, need, spec):
     # Reuse basic logic to scrape discovery mixes
     # We want "My Daily Discovery" and "My Mix 1-8" (Adventure)
-    # Temporary config for fetching discovery
     temp_conf = {"modes": {"basic": {"daily_discovery": True, "new_arrivals": False, "my_mixes": True}}}
     discovery = fetch_basic_tracks(session, temp_conf)
     print(f"- Fetched {len(discovery)} Adventure tracks")
 
-    # 2. Bucket Allocation
-    limit_comfort = int(limit * 0.4)
-    limit_habit = int(limit * 0.3)
-    limit_adventure = int(limit * 0.3)
-    
-    # Adjust for rounding
-    remainder = limit - (limit_comfort + limit_habit + limit_adventure)
-    limit_comfort += remainder
+    # Thin mixes: widen with a local graph walk from recently played artists
+    want = need * 2
+    if spec.get("expand", True) and len(discovery) < want:
+        try:
+            history = fetch_history(session)
+        except Exception:
+            history = []
+        seeds = {getattr(getattr(t, 'artist', None), 'id', None) for t in history}
+        known = {t.id for t in discovery} | {t.id for t in history}
+        expanded = artist_graph.expand(seeds, want - len(discovery), known)
+        if expanded:
+            print(f"- Expanded Adventure with {len(expanded)} tracks from the artist graph")
+        discovery = discovery + expanded
+    return discovery
 
-    # 3. Filter & Select
-    # Comfort: Favorites > 6 months (approx 180 days)
-    six_months_ago = datetime.now(timezone.utc) - timedelta(days=180)
-    
-    old_favorites = []
-    recent_favorites = []
-    
-    for t in favorites:
-        # Check for date added. user.favorites.tracks() usually returns existing objects
-        # We might need to check how tidalapi returns them.
-        # Often it is t.date_added (datetime)
-        if hasattr(t, 'date_added') and t.date_added:
-            d = t.date_added
-            # Ensure aware
-            if d.tzinfo is None:
-                d = d.replace(tzinfo=timezone.utc)
-                
-            if d < six_months_ago:
-                old_favorites.append(t)
-            else:
-                recent_favorites.append(t)
-        else:
-            # Fallback if no date
-            recent_favorites.append(t)
-            
-    print(f"- Filtering Comfort: {len(old_favorites)} old (>6m), {len(recent_favorites)} recent/unknown")
-    
-    # Prioritize old, fill with recent if needed
-    random.shuffle(old_favorites)
-    random.shuffle(recent_favorites)
-    
-    bucket_comfort = old_favorites[:limit_comfort]
-    if len(bucket_comfort) < limit_comfort:
-        needed = limit_comfort - len(bucket_comfort)
-        bucket_comfort.extend(recent_favorites[:needed])
+@register_source("new_arrivals")
+def _source_new_arrivals(session, need, spec):
+    temp_conf = {"modes": {"basic": {"daily_discovery": False, "new_arrivals": True, "my_mixes": False}}}
+    return fetch_basic_tracks(session, temp_conf)
 
-    # Habit: Recent history
-    # History is usually recency sorted. We take top 100 above.
-    # We need 60 (for 200 limit). Let's take random from that recent 100? Or just most recent?
-    # "Fetch the last 100... Take 60". Let's shuffle to not just be the absolute last listened.
-    random.shuffle(history)
-    bucket_habit = history[:limit_habit]
+@register_predicate("older_than")
+def _older_than(track, spec):
+    d = track_date_added(track)
+    return bool(d) and d < _cutoff(spec)
 
-    # Adventure: Discovery mixes
-    random.shuffle(discovery)
-    bucket_adventure = discovery[:limit_adventure]
-
-    # Backfill if any bucket is short
-    # Simple pool to draw from for backfill: everything distinct not yet used
-    used_ids = set(t.id for t in bucket_comfort + bucket_habit + bucket_adventure)
-    all_pool = [t for t in favorites + history + discovery if t.id not in used_ids]
-    random.shuffle(all_pool)
-
-    def fill_bucket(bucket, target_size, name):
-        needed = target_size - len(bucket)
-        if needed > 0:
-            print(f"- {name} bucket short by {needed}, backfilling...")
-            added = 0
-            while needed > 0 and all_pool:
-                t = all_pool.pop()
-                bucket.append(t)
-                needed -= 1
-                added += 1
-            if needed > 0:
-                print(f"  Warning: Could not fully backfill {name}.")
-
-    fill_bucket(bucket_comfort, limit_comfort, "Comfort")
-    fill_bucket(bucket_habit, limit_habit, "Habit")
-    fill_bucket(bucket_adventure, limit_adventure, "Adventure")
-
-    # 4. Interleave (C, H, A, C, H, A...)
-    final_list = []
-    max_len = max(len(bucket_comfort), len(bucket_habit), len(bucket_adventure))
-    
-    for i in range(max_len):
-        if i < len(bucket_comfort): final_list.append(bucket_comfort[i])
-        if i < len(bucket_habit): final_list.append(bucket_habit[i])
-        if i < len(bucket_adventure): final_list.append(bucket_adventure[i])
-
-    # 5. Smoothing (BPM / Popularity)
-    # Interleaving (C, H, A) ensures Adventure tracks are not clustered (spaced by 2).
-    # We apply BPM "Jitter" smoothing.
-    print("- Applying Vibe Check (BPM Smoothing)...")
+@register_predicate("newer_than")
+def _newer_than(track, spec):
+    d = track_date_added(track)
+    return bool(d) and d >= _cutoff(spec)
+
+@register_predicate("bpm_between")
+def _bpm_between(track, spec):
+    try:
+        bpm = int(getattr(track, 'bpm', 0) or 0)
+    except (TypeError, ValueError):
+        return False
+    return bool(bpm) and spec.get("min_bpm", 0) <= bpm <= spec.get("max_bpm", 999)
+
+def fetch_fusion_tracks(session, config, limit=200, buckets=None):
+    """
+    Fetch and interleave tracks for 'Fusion' mode.
+    Default logic: Comfort (40%), Habit (30%), Adventure (30%); configurable via modes.fusion.buckets.
+    If buckets (dict) is given, it is filled with track id -> bucket name.
+    """
+    print(f"Fusion Mode: Generating {limit} tracks...")
+    specs = fusion_buckets(config)
+
+    # 1-3. Fetch, filter and backfill each bucket
+    filled = bucket_engine.fill_buckets(session, specs, limit)
+
+    if buckets is not None:
+        for spec, bucket in filled:
+            for t in bucket:
+                buckets[t.id] = spec.get("name", "bucket").lower()
+
+    # 4. Interleave (smooth weighted round-robin, proportional to bucket size)
+    final_list = bucket_engine.interleave([bucket for spec, bucket in filled])
+
+    # 5. Artist spread
+    final_list = spread_tracks(final_list, config)
+    artist_gap, album_gap = spread_gaps(config)
+
+    # 6. Smoothing (BPM / Popularity)
+    # Weighted interleaving keeps each bucket spread across the list.
+    # We apply BPM "Jitter" smoothing, rejecting swaps that would break the spread.
+    # Skipped entirely when `doctor` found no BPM data on tracks.
+    bpm_available = doctor.has("bpm")
+    if bpm_available:
+        print("- Applying Vibe Check (BPM Smoothing)...")
+    else:
+        print("- Skipping Vibe Check (no BPM data available)...")
     
     # Filter out tracks without BPM for the logic, or treat them as neutral?
     # We'll just skip smoothing for index i if BPM is missing.
     
     # We iterate 0 to len-2
     swaps_made = 0
-    for i in range(len(final_list) - 1):
+    for i in range(len(final_list) - 1 if bpm_available else 0):
         current = final_list[i]
         next_track = final_list[i+1]
         
@@ -363,6 +556,10 @@ def fetch_fusion_tracks(session, config, limit=200):
                 if abs(current_bpm - cand_bpm) <= 30:
                     # Found a better valid next track. Swap index i+1 with index j
                     final_list[i+1], final_list[j] = final_list[j], final_list[i+1]
+                    if spread_scheduler.conflicts_at(final_list, i + 1, artist_gap, album_gap) \
+                            or spread_scheduler.conflicts_at(final_list, j, artist_gap, album_gap):
+                        final_list[i+1], final_list[j] = final_list[j], final_list[i+1]
+                        continue
                     swaps_made += 1
                     found_swap = True
                     break
@@ -374,57 +571,75 @@ def fetch_fusion_tracks(session, config, limit=200):
         avg_bpm = sum(bpms) / len(bpms)
 
     print(f"Fusion Generation: {len(final_list)} tracks.")
-    print(f"  Composition: {len(bucket_comfort)} Classics, {len(bucket_habit)} Current Rotation, {len(bucket_adventure)} New Discoveries.")
+    print("  Composition: " + ", ".join(f"{len(bucket)} {spec.get('label', spec.get('name'))}" for spec, bucket in filled) + ".")
     print(f"  Vibe Check: Average BPM: {int(avg_bpm)} | Swaps made: {swaps_made} | Replay Gain Adjusted")
     
     return final_list
 
-def log_generation(tracks, mode):
+def spread_gaps(config):
+    """Configured (artist_gap, album_gap) for the artist spread."""
+    spread_conf = config.get("spread", {})
+    return (spread_conf.get("artist_gap", spread_scheduler.DEFAULT_ARTIST_GAP),
+            spread_conf.get("album_gap", spread_scheduler.DEFAULT_ALBUM_GAP))
+
+def spread_tracks(tracks, config):
     """
-    Log the generated tracks to a file.
+    Shared stage: keep the same artist/album from playing back to back.
+    Fusion runs it before BPM smoothing; Basic runs it last.
     """
-    timestamp = datetime.now().strftime("%Y%m%d-%H:%M:%S")
-    filename = f"fusion-log-{timestamp}.txt"
-    
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            f.write(f"Tidal Fusion Generation Log\n")
-            f.write(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Mode: {mode}\n")
-            f.write(f"Total Tracks: {len(tracks)}\n")
-            f.write("-" * 40 + "\n")
-            
-            for i, track in enumerate(tracks, 1):
-                artist = getattr(track, 'artist', None)
-                if artist:
-                    artist_name = artist.name
-                else:
-                     # sometimes track.artists is a list
-                    artists = getattr(track, 'artists', [])
-                    artist_name = ", ".join([a.name for a in artists]) if artists else "Unknown Artist"
-                
-                title = getattr(track, 'name', 'Unknown Title')
-                bpm = getattr(track, 'bpm', 'N/A')
-                
-                f.write(f"{i}. {artist_name} - {title} [BPM: {bpm}]\n")
-                
-        print(f"Log generated: {filename}")
-    except Exception as e:
-        print(f"Error writing log: {e}")
+    artist_gap, album_gap = spread_gaps(config)
+    ordered, violations = spread_scheduler.schedule(tracks, artist_gap, album_gap)
+    print(f"Artist Spread: gap {artist_gap} (album {album_gap}) | Unresolved conflicts: {violations}")
+    return ordered
+
+def log_generation(tracks, mode, buckets=None, timings=None, config=None):
+    """
+    Record the generated tracks in the history store (CONFIG_DIR/history).
+    The write happens on a background thread; returns it so the caller can join().
+    """
+    hist_conf = (config or {}).get("history", {})
+    record = history_store.build_record(tracks, mode, buckets, timings)
+    print(f"Logging {len(tracks)} tracks to history ({history_store.HISTORY_DIR})")
+    return history_store.append_async(
+        record,
+        hist_conf.get("max_bytes", history_store.DEFAULT_MAX_BYTES),
+        hist_conf.get("max_age_days", history_store.DEFAULT_MAX_AGE_DAYS)
+    )
 
 # --- Playlist Management ---
 
-def update_playlist(session, args, tracks):
+UPLOAD_CHUNK_SIZE = 100
+
+def create_playlist(session, name=DEFAULT_PLAYLIST_NAME):
+    """Create a playlist; the staging buffer is made private where supported."""
+    staging = name == STAGING_PLAYLIST_NAME
+    new_pl = session.user.create_playlist(name, STAGING_DESCRIPTION if staging else PLAYLIST_DESCRIPTION)
+    invalidate_playlist_listings(session)
+    if staging:
+        hide_playlist(new_pl)
+    return new_pl
+
+def hide_playlist(playlist):
+    """Best effort: keep the staging buffer out of public view."""
+    if hasattr(playlist, 'set_playlist_private'):
+        try:
+            playlist.set_playlist_private()
+        except Exception as e:
+            print(f"- Warning: Could not make playlist private ({e}).")
+
+def show_playlist(playlist):
+    """Best effort: make a published staging buffer public again."""
+    if hasattr(playlist, 'set_playlist_public'):
+        try:
+            playlist.set_playlist_public()
+        except Exception as e:
+            print(f"- Warning: Could not make playlist public ({e}).")
+
+def find_target_playlist(session, name=DEFAULT_PLAYLIST_NAME):
     """
-    Update the playlist.
-    args.new = True -> Empty and Fill
-    args.append = True -> Add
+    Locate the target playlist by name, deleting any duplicates.
+    Returns the playlist or None if it does not exist yet.
     """
-    if not tracks:
-        print("No tracks generated.")
-        return
-
-    name = DEFAULT_PLAYLIST_NAME
     user = session.user
     
     # 1. Find Playlist (Robust Discovery)
@@ -436,7 +651,7 @@ def update_playlist(session, args, tracks):
     # Check Created Playlists (Primary source for ownership)
     if hasattr(user, 'playlists'):
         try:
-            for pl in user.playlists():
+            for pl in list_user_playlists(session):
                 if pl.name == name:
                     if pl.id not in seen_ids:
                         candidates.append(pl)
@@ -447,7 +662,7 @@ def update_playlist(session, args, tracks):
     # Check Favorites (Secondary, sometimes created playlists only show here)
     if hasattr(user, 'favorites'):
         try:
-            for pl in user.favorites.playlists():
+            for pl in list_favorite_playlists(session):
                 if pl.name == name:
                     if pl.id not in seen_ids:
                         candidates.append(pl)
@@ -473,6 +688,7 @@ def update_playlist(session, args, tracks):
                 # Try standard delete
                 if hasattr(dup, 'delete'):
                     dup.delete()
+                    invalidate_playlist_listings(session)
                     print("- Deleted.")
                 else:
                     # Some objects might be read-only proxies
@@ -487,95 +703,282 @@ def update_playlist(session, args, tracks):
     else:
         print(f"Playlist '{name}' not found. Will create new.")
 
-    # 3. Update Logic
-    track_ids = [t.id for t in tracks]
+    return target_pl
+
+def reset_playlist(session, target_pl, name=DEFAULT_PLAYLIST_NAME):
+    """
+    Empty the target playlist so it can be refilled.
+    Falls back to delete-and-recreate; returns the (possibly new) empty playlist or None.
+    """
+    print(f"Reseting '{target_pl.name}'...")
+    success = False
     
-    if args.append:
-        if target_pl:
-            print(f"Appending {len(tracks)} tracks...")
-            try:
-                target_pl.add(track_ids)
-                print("Success.")
-            except Exception as e:
-                print(f"Error appending: {e}")
-        else:
-            print(f"Creating new playlist '{name}'...")
-            user.create_playlist(name, "Generated by Tidal Fusion").add(track_ids)
+    # Attempt 1: Clear
+    try:
+        # Check existing items
+        # We need to fetch items to check if empty, and to get IDs if we need manual removal
+        current_items = target_pl.items()
+        
+        if current_items:
+            print(f"- Found {len(current_items)} existing tracks. Attempting to clear...")
             
-    else: # args.new (Default) or explicit -n
-        if target_pl:
-            print(f"Reseting '{target_pl.name}' with {len(tracks)} tracks...")
-            success = False
+            cleared = False
+            # Priority 1: Use .clear() if available
+            if hasattr(target_pl, 'clear') and doctor.has("bulk_clear"):
+                try:
+                    target_pl.clear()
+                    cleared = True
+                    print("- Called .clear()")
+                except Exception as e:
+                    print(f"- .clear() failed: {e}")
+
+            # Priority 2: One bulk remove_by_indices call
+            if not cleared and hasattr(target_pl, 'remove_by_indices') and doctor.has("bulk_remove"):
+                try:
+                    count = getattr(target_pl, 'num_tracks', None) or len(current_items)
+                    target_pl.remove_by_indices(list(range(count)))
+                    cleared = True
+                    print("- Called .remove_by_indices()")
+                except Exception as e:
+                    print(f"- .remove_by_indices() failed: {e}")
             
-            # Attempt 1: Clear and Add
-            try:
-                # Check existing items
-                # We need to fetch items to check if empty, and to get IDs if we need manual removal
-                current_items = target_pl.items()
-                
-                if current_items:
-                    print(f"- Found {len(current_items)} existing tracks. Attempting to clear...")
-                    
-                    cleared = False
-                    # Priority 1: Use .clear() if available
-                    if hasattr(target_pl, 'clear'):
-                        try:
-                            target_pl.clear()
-                            cleared = True
-                            print("- Called .clear()")
-                        except Exception as e:
-                            print(f"- .clear() failed: {e}")
-                    
-                    # Priority 2: Manual remove_by_id loop
-                    if not cleared:
-                        print("- Fallback: Removing tracks one by one...")
-                        if hasattr(target_pl, 'remove_by_id'):
-                            for item in current_items:
-                                if hasattr(item, 'id'):
-                                    try:
-                                        target_pl.remove_by_id(item.id)
-                                    except: pass
-                        else:
-                             print("- Warning: remove_by_id not found.")
-
-                    # Verify Empty
-                    remaining = target_pl.items()
-                    if remaining:
-                        print(f"- Warning: {len(remaining)} items remain. Clearing failed.")
-                        success = False
-                    else:
-                        print("- Playlist cleared.")
-                        success = True
+            # Priority 3: Manual remove_by_id loop
+            if not cleared:
+                print("- Fallback: Removing tracks one by one...")
+                if hasattr(target_pl, 'remove_by_id'):
+                    for item in current_items:
+                        if hasattr(item, 'id'):
+                            try:
+                                target_pl.remove_by_id(item.id)
+                            except: pass
                 else:
-                    print("- Playlist already empty.")
-                    success = True
-                
-                if success:
-                    target_pl.add(track_ids)
-                    print("- Added new tracks.")
-                    
-            except Exception as e:
-                print(f"- Update failed: {e}")
+                     print("- Warning: remove_by_id not found.")
+
+            # Verify Empty
+            remaining = target_pl.items()
+            if remaining:
+                print(f"- Warning: {len(remaining)} items remain. Clearing failed.")
                 success = False
+            else:
+                print("- Playlist cleared.")
+                success = True
+        else:
+            print("- Playlist already empty.")
+            success = True
+            
+    except Exception as e:
+        print(f"- Update failed: {e}")
+        success = False
 
-            # Fallback: Delete and Recreate
-            if not success:
-                print("Fallback: Deleting and recreating playlist...")
-                try:
-                    target_pl.delete()
-                    print("- Old playlist deleted.")
-                except Exception as e:
-                    print(f"- Warning: Could not delete old playlist ({e}).")
-                
+    if success:
+        return target_pl
+
+    # Fallback: Delete and Recreate
+    print("Fallback: Deleting and recreating playlist...")
+    try:
+        target_pl.delete()
+        invalidate_playlist_listings(session)
+        playlist_state.forget(target_pl.id)
+        print("- Old playlist deleted.")
+    except Exception as e:
+        print(f"- Warning: Could not delete old playlist ({e}).")
+    
+    try:
+        new_pl = create_playlist(session, name)
+        print("- New playlist created.")
+        return new_pl
+    except Exception as e:
+        print(f"CRITICAL: Failed to create new playlist: {e}")
+        return None
+
+def prepare_playlist(session, target_pl, append=False, name=DEFAULT_PLAYLIST_NAME):
+    """
+    Make a resolved target playlist ready for adding: create it if missing and
+    (unless appending) empty it. Only called once there are tracks to add.
+    """
+    if target_pl is None:
+        print(f"Creating '{name}'...")
+        return create_playlist(session, name)
+    if append:
+        return target_pl
+    return reset_playlist(session, target_pl, name)
+
+def trim_oldest(playlist, members, max_size):
+    """
+    Remove the oldest entries so the playlist holds at most max_size tracks.
+    Uses a single remove_by_indices call; returns the remaining member ids.
+    """
+    excess = len(members) - max_size
+    if excess <= 0:
+        return members
+
+    print(f"- Trimming {excess} oldest tracks (max size {max_size})...")
+    if hasattr(playlist, 'remove_by_indices') and doctor.has("bulk_remove"):
+        playlist.remove_by_indices(list(range(excess)))
+    elif hasattr(playlist, 'remove_by_id'):
+        print("- Fallback: Removing tracks one by one...")
+        for tid in members[:excess]:
+            try:
+                playlist.remove_by_id(tid)
+            except: pass
+    else:
+        print("- Warning: Playlist does not support removal, cannot trim.")
+        return members
+    return members[excess:]
+
+def prefetch_target(session, append=False, name=DEFAULT_PLAYLIST_NAME):
+    """
+    Look up the target playlist (and, when appending, its cached membership) on a
+    background thread while tracks are generated. Nothing is modified.
+    Returns a Future of (playlist or None, member ids).
+    """
+    fut = Future()
+
+    def run():
+        try:
+            target_pl = find_target_playlist(session, name)
+            # A reset playlist is known to be empty; otherwise use the cached membership
+            members = playlist_state.load_members(target_pl) if append and target_pl is not None else []
+            fut.set_result((target_pl, members))
+        except BaseException as e:
+            fut.set_exception(e)
+
+    # Daemon: a lookup must never keep an interrupted run alive
+    threading.Thread(target=run, name="playlist-lookup", daemon=True).start()
+    return fut
+
+def upload_tracks(session, target, tracks, append=False, name=DEFAULT_PLAYLIST_NAME, max_size=None):
+    """
+    Fill the target playlist from a prefetch_target() lookup.
+    The playlist is only created or emptied here, once there are tracks, so a run
+    that produces nothing leaves it untouched. Tracks already in the playlist
+    (cached id set, see playlist_state) are skipped; in append mode max_size trims
+    the oldest entries. Returns (playlist, member ids, failed count).
+    """
+    if not tracks:
+        print(f"Nothing to upload; '{name}' left unchanged.")
+        return None, [], 0
+
+    try:
+        target_pl, members = target.result()
+        playlist = prepare_playlist(session, target_pl, append, name)
+    except Exception as e:
+        print(f"Error preparing playlist: {e}")
+        return None, [], len(tracks)
+    if playlist is None:
+        return None, [], len(tracks)
+
+    members = list(members)
+    member_set = set(members)
+    new_ids = []
+    for t in tracks:
+        if t.id not in member_set:
+            member_set.add(t.id)
+            new_ids.append(t.id)
+    skipped = len(tracks) - len(new_ids)
+
+    added = failed = 0
+    for i in range(0, len(new_ids), UPLOAD_CHUNK_SIZE):
+        chunk = new_ids[i:i + UPLOAD_CHUNK_SIZE]
+        try:
+            playlist.add(chunk)
+            members.extend(chunk)
+            added += len(chunk)
+        except Exception as e:
+            print(f"- Error adding {len(chunk)} tracks: {e}")
+            failed += len(chunk)
+
+    print(f"Upload complete: {added} tracks added to '{name}'"
+          + (f", {skipped} already present" if skipped else "")
+          + (f", {failed} failed." if failed else "."))
+
+    if failed:
+        # Server state is uncertain; rebuild membership next time
+        playlist_state.forget(playlist.id)
+        return playlist, members, failed
+    try:
+        if append and max_size:
+            members = trim_oldest(playlist, members, max_size)
+        playlist_state.save_members(playlist, members, session)
+    except Exception as e:
+        print(f"- Error trimming playlist: {e}")
+        playlist_state.forget(playlist.id)
+    return playlist, members, failed
+
+def publish_staging(session, staging_pl, track_ids, name=DEFAULT_PLAYLIST_NAME):
+    """
+    Make a filled staging playlist live with as few operations as possible.
+    Preferred: swap titles/descriptions (two edits), recycling the old live playlist
+    as the next staging buffer. Fallback: one bulk replace of the live playlist.
+    Returns the playlist that is now live, or None if publishing failed.
+    """
+    try:
+        live_pl = find_target_playlist(session, name)
+    except Exception as e:
+        print(f"Error looking up '{name}': {e}")
+        return None
+    can_edit = doctor.has("edit_metadata") and hasattr(staging_pl, 'edit')
+
+    if live_pl is None:
+        if can_edit:
+            try:
+                staging_pl.edit(title=name, description=PLAYLIST_DESCRIPTION)
+            except Exception as e:
+                print(f"- Rename failed ({e}), creating '{name}' instead.")
+            else:
+                show_playlist(staging_pl)
+                invalidate_playlist_listings(session)
+                print(f"Published staging playlist as '{name}'.")
+                return staging_pl
+        try:
+            live_pl = create_playlist(session, name)
+        except Exception as e:
+            print(f"Error creating '{name}': {e}")
+            return None
+
+    elif can_edit and hasattr(live_pl, 'edit'):
+        print(f"Swapping staging playlist into '{name}'...")
+        try:
+            # Rename staging first so there is never a moment without a live playlist
+            staging_pl.edit(title=name, description=PLAYLIST_DESCRIPTION)
+        except Exception as e:
+            print(f"- Swap failed ({e}), falling back to bulk replace.")
+        else:
+            show_playlist(staging_pl)
+            try:
+                live_pl.edit(title=STAGING_PLAYLIST_NAME, description=STAGING_DESCRIPTION)
+                hide_playlist(live_pl)
+                print("- Swapped. Previous playlist recycled as the next staging buffer.")
+            except Exception as e:
+                # Two live copies would be cleaned up as duplicates on the next run anyway
+                print(f"- Warning: Could not recycle previous playlist ({e}), deleting it.")
                 try:
-                    user.create_playlist(name, "Generated by Tidal Fusion").add(track_ids)
-                    print("- New playlist created.")
+                    live_pl.delete()
+                    playlist_state.forget(live_pl.id)
                 except Exception as e:
-                    print(f"CRITICAL: Failed to create new playlist: {e}")
-        else:
-            print(f"Creating '{name}' with {len(tracks)} tracks...")
-            user.create_playlist(name, "Generated by Tidal Fusion").add(track_ids)
+                    print(f"- Warning: Could not delete previous playlist ({e}).")
+            invalidate_playlist_listings(session)
+            return staging_pl
 
+    # Fallback: one bulk replace (window is a single clear + chunked add)
+    try:
+        live_pl = reset_playlist(session, live_pl, name)
+        if live_pl is None:
+            return None
+        for i in range(0, len(track_ids), UPLOAD_CHUNK_SIZE):
+            live_pl.add(track_ids[i:i + UPLOAD_CHUNK_SIZE])
+    except Exception as e:
+        print(f"Error replacing contents of '{name}': {e}")
+        if live_pl is not None:
+            playlist_state.forget(live_pl.id)
+        return None
+    try:
+        playlist_state.save_members(live_pl, track_ids, session)
+    except Exception as e:
+        print(f"- Warning: Could not record membership ({e}).")
+        playlist_state.forget(live_pl.id)
+    print(f"- Replaced contents of '{name}' with {len(track_ids)} tracks.")
+    return live_pl
 
 def main():
     parser = argparse.ArgumentParser(description="Tidal Fusion", add_help=False)
@@ -587,6 +990,8 @@ def main():
 
     mode_group.add_argument('-a', '--append', action='store_true', help="Append to playlist")
     mode_group.add_argument('-c', '--config', action='store_true', help="Configure settings")
+    mode_group.add_argument('--history', action='store_true', help="Query generation history")
+    mode_group.add_argument('--doctor', action='store_true', help="Measure API latency and detect capabilities")
     
     # Help (Standalone)
     parser.add_argument('-h', '--help', action='store_true', help="Show help")
@@ -594,6 +999,10 @@ def main():
     # Modifiers
     parser.add_argument('--mode', type=str, help="Select mode (basic, fusion)")
     parser.add_argument('-m', '--limit', type=int, default=200, help="Track limit (Fusion mode)")
+    parser.add_argument('--staged', action='store_true', help="Fill a staging playlist, then swap it live (with -n)")
+    parser.add_argument('--max-size', type=int, help="Cap playlist size when appending (oldest tracks are removed)")
+    parser.add_argument('--track', type=str, help="Track ID to look up (--history)")
+    parser.add_argument('--days', type=int, default=30, help="Look-back window in days (--history)")
 
     args = parser.parse_args()
     
@@ -606,18 +1015,34 @@ def main():
             print("Help: -n / --new")
             print("  Resets (empties) the target playlist and fills it with new tracks.")
             print("  This is the default action if no other action is specified.")
+            print("  --staged : Fill a hidden staging playlist first, then swap it live in one step.")
+            print("             Listeners never see an empty playlist; the playlist ID changes on each run.")
         elif args.append:
              print("Help: -a / --append")
              print("  Adds generated tracks to the existing playlist instead of reseting it.")
+             print("  Tracks already in the playlist are skipped.")
+             print("  --max-size <N> : Remove the oldest tracks so the playlist stays at N.")
         elif args.config:
              print("Help: -c / --config")
              print("  Opens the configuration menu.")
              print("  Use --mode <name> to configure a specific mode.")
+        elif args.doctor:
+             print("Help: --doctor")
+             print("  Probes the Tidal endpoints used by Tidal Fusion and reports p50/p95 latency and page sizes.")
+             print("  Detects available fast paths (bulk clear/remove, BPM data, paging) and caches them,")
+             print("  so generation and playlist updates can pick the fastest supported path.")
+        elif args.history:
+             print("Help: --history")
+             print("  Queries the generation history stored in the config directory.")
+             print("  --track <id> : How often a track was served.")
+             print("  --days <N>   : Look-back window in days (Default: 30).")
         else:
             print("Tidal Fusion Help")
             print("  -n, --new     : Create/Reset playlist (Default)")
             print("  -a, --append  : Append to playlist")
             print("  -c, --config  : Configure modes")
+            print("  --history     : Query generation history")
+            print("  --doctor      : Check API latency and capabilities")
             print("  --mode <name> : Select mode (basic, fusion)")
             print("  -m, --limit   : Set max tracks (Fusion)")
         return
@@ -638,6 +1063,11 @@ def main():
             configure_global(config)
         return
 
+    # 2. History
+    if args.history:
+        history_store.query(args.track, args.days)
+        return
+
     # 3. Generation (New or Append)
     # Default is New if neither specified
     action_new = True
@@ -652,21 +1082,62 @@ def main():
         print("Please run 'tidal-fusion -c' and select 'Run Authentication' first.")
         return
 
-    tracks = []
-    if mode == 'basic':
-        tracks = fetch_basic_tracks(session, config)
-    elif mode == 'fusion':
-        tracks = fetch_fusion_tracks(session, config, args.limit)
-    else:
+    # Doctor (needs a session)
+    if args.doctor:
+        doctor.run(session)
+        return
+
+    if mode not in ('basic', 'fusion'):
         print(f"Unknown mode: {mode}")
         return
 
-    # Shuffle for basic (Fusion does its own interleaving)
+    # Look up the target playlist while candidates are being fetched; it is only
+    # emptied once the final order is known, then filled in chunks.
+    tracks = []
+    buckets = {}
+    timings = {}
+    t0 = time.monotonic()
+    # Staged publishing fills a hidden buffer and swaps it in at the end
+    staged = args.staged and not args.append
+    if args.staged and args.append:
+        print("Note: --staged is ignored when appending.")
+    target_name = STAGING_PLAYLIST_NAME if staged else DEFAULT_PLAYLIST_NAME
+    target = prefetch_target(session, args.append, target_name)
+
     if mode == 'basic':
+        tracks = fetch_basic_tracks(session, config)
+        # Shuffle for basic (Fusion does its own interleaving)
         random.shuffle(tracks)
-        
-    log_generation(tracks, mode)
-    update_playlist(session, args, tracks)
+        tracks = spread_tracks(tracks, config)
+    else:
+        # Already spread (before BPM smoothing)
+        tracks = fetch_fusion_tracks(session, config, args.limit, buckets)
+    timings["generate"] = time.monotonic() - t0
+
+    if not tracks:
+        print("No tracks generated.")
+    t1 = time.monotonic()
+    playlist, members, failed = upload_tracks(session, target, tracks, args.append, target_name, args.max_size)
+    timings["upload"] = time.monotonic() - t1
+
+    if staged and tracks and playlist is not None and not failed:
+        t2 = time.monotonic()
+        if publish_staging(session, playlist, members) is None:
+            print(f"Publishing failed; '{DEFAULT_PLAYLIST_NAME}' may be unchanged or incomplete. "
+                  f"The new tracks remain in '{STAGING_PLAYLIST_NAME}'.")
+        timings["publish"] = time.monotonic() - t2
+    elif staged and failed:
+        print("Staging upload incomplete; live playlist left unchanged.")
+    timings["total"] = time.monotonic() - t0
+
+    cache = cache_for(session)
+    print(f"Request cache: {cache.misses} remote fetches, {cache.hits} coalesced.")
+
+    writers = [artist_graph.save_async()]
+    if tracks:
+        writers.append(log_generation(tracks, mode, buckets, timings, config))
+    for w in writers:
+        w.join()
 
 if __name__ == "__main__":
     main()